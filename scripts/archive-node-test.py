@@ -1,12 +1,20 @@
 import requests
 import json
-from typing import Dict, List
+from typing import Dict, Iterator
 import concurrent.futures
 from urllib.parse import urljoin
 import logging
+import re
 import sys
 import base64
 
+# ijson is optional; it lets endpoint tests start while the RPC list is still
+# downloading, otherwise the whole list is parsed at once
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
 # ANSI color codes
 GREEN = '\033[92m'
 YELLOW = '\033[93m'
@@ -21,26 +29,37 @@ logging.basicConfig(
 )
 
 RPC_LIST_URL = "https://raw.githubusercontent.com/Luminara-Hub/namada-ecosystem/refs/heads/main/user-and-dev-tools/mainnet/rpc.json"
+
+# Endpoints are all distinct hosts, so they can all be tested at once
+MAX_CONCURRENT_TESTS = 64
+
+# Shared session so the RPC list fetch and endpoint tests reuse pooled connections
+SESSION = requests.Session()
+
+BLOCK_LIMIT_RE = re.compile(r'Cannot query more than (\d+) blocks')
+
 ABCI_QUERY_STRING = "/abci_query?path=%22/shell/value/%23tnam1pyqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqej6juv/%23tnam1q9gr66cvu4hrzm0sd5kmlnjje82gs3xlfg3v6nu7/balance/minted%22&height=1"
 
 def is_base64(s: str) -> bool:
     """Check if a string is base64 encoded."""
     try:
-        # Try to decode the string
-        base64.b64decode(s)
-        # Check if the string only contains valid base64 characters
-        return all(c in 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=' for c in s)
-    except Exception:
+        # validate=True rejects any characters outside the base64 alphabet
+        base64.b64decode(s, validate=True)
+        return True
+    except ValueError:  # binascii.Error is a subclass of ValueError
         return False
 
-def get_rpc_list() -> List[Dict]:
-    """Fetch the list of RPC endpoints."""
+def iter_rpc_list() -> Iterator[Dict]:
+    """Fetch the list of RPC endpoints, yielding each one as soon as it is parsed."""
     logging.info("Fetching RPC list from %s", RPC_LIST_URL)
-    response = requests.get(RPC_LIST_URL)
-    response.raise_for_status()
-    rpc_list = response.json()
-    logging.info("Found %d RPC endpoints to test", len(rpc_list))
-    return rpc_list
+    with SESSION.get(RPC_LIST_URL, stream=True) as response:
+        response.raise_for_status()
+        if ijson is not None:
+            # Let urllib3 undo any gzip/deflate encoding on the raw stream
+            response.raw.decode_content = True
+            yield from ijson.items(response.raw, "item")
+        else:
+            yield from response.json()
 
 def test_endpoint(rpc_info: Dict) -> Dict:
     """Test a single RPC endpoint and return the result."""
@@ -49,7 +68,7 @@ def test_endpoint(rpc_info: Dict) -> Dict:
     
     logging.info("Testing endpoint: %s", base_url)
     try:
-        response = requests.get(full_url, timeout=10)
+        response = SESSION.get(full_url, timeout=10)
         response.raise_for_status()
         data = response.json()
         
@@ -70,8 +89,7 @@ def test_endpoint(rpc_info: Dict) -> Dict:
         error_info = response_data.get("info", "")
         if "Cannot query more than" in error_info:
             # Extract the number from the error message
-            import re
-            match = re.search(r'Cannot query more than (\d+) blocks', error_info)
+            match = BLOCK_LIMIT_RE.search(error_info)
             if match:
                 block_limit = int(match.group(1))
                 logging.info("✓ Successfully tested %s - Block limit: %d", base_url, block_limit)
@@ -99,16 +117,16 @@ def test_endpoint(rpc_info: Dict) -> Dict:
         }
 
 def main():
-    # Get the list of RPC endpoints
-    rpc_list = get_rpc_list()
-    
-    # Test all endpoints concurrently
+    # Start testing each endpoint as soon as it is read from the RPC list; total
+    # time is bounded by the slowest endpoint rather than by batches of workers
     results = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_rpc = {executor.submit(test_endpoint, rpc): rpc for rpc in rpc_list}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_CONCURRENT_TESTS) as executor:
+        future_to_rpc = {executor.submit(test_endpoint, rpc): rpc for rpc in iter_rpc_list()}
+        logging.info("Found %d RPC endpoints to test", len(future_to_rpc))
         for future in concurrent.futures.as_completed(future_to_rpc):
             result = future.result()
             results.append(result)
+    SESSION.close()
     
     # Sort results by block limit (None values at the end)
     results.sort(key=lambda x: (x["block_limit"] is None, -(x["block_limit"] or 0)))
@@ -1,14 +1,66 @@
-import requests
+import httpx
+import msgspec
+import orjson
 import json
 import csv
 import base64
 import time
 import os
 import argparse
+import concurrent.futures
+import collections
+import threading
+import types
+import functools
 from datetime import datetime
-from typing import Optional, List, Tuple
+from typing import Any, Optional, List, Tuple, NamedTuple, Callable, TypeVar, Iterator
 from urllib.parse import quote
-import struct
+
+# RPC replies are decoded straight into typed structs that skip every field we
+# don't read. A reply that doesn't match the schema is decoded into
+# SimpleNamespace objects instead, which give the same attribute access.
+class AbciQueryResponse(msgspec.Struct):
+    code: int = 0
+    value: Optional[str] = None
+    info: str = ""
+
+class BlockHeader(msgspec.Struct):
+    time: str
+    height: Optional[str] = None
+
+class Block(msgspec.Struct):
+    header: BlockHeader
+
+class RpcResult(msgspec.Struct):
+    response: Optional[AbciQueryResponse] = None
+    header: Optional[BlockHeader] = None
+    block: Optional[Block] = None
+
+class RpcReply(msgspec.Struct):
+    id: int = -1
+    result: Optional[RpcResult] = None
+    error: Any = None
+
+_rpc_reply_decoder = msgspec.json.Decoder(RpcReply)
+_rpc_batch_decoder = msgspec.json.Decoder(List[RpcReply])
+
+def _decode_rpc_namespace(content: bytes):
+    """Decode JSON into nested SimpleNamespace objects."""
+    return json.loads(content, object_hook=lambda d: types.SimpleNamespace(**d))
+
+def decode_rpc_reply(content: bytes):
+    """Decode a single JSON-RPC reply."""
+    try:
+        return _rpc_reply_decoder.decode(content)
+    except msgspec.ValidationError:
+        return _decode_rpc_namespace(content)
+
+def decode_rpc_batch(content: bytes):
+    """Decode the list of replies to a JSON-RPC batch."""
+    try:
+        return _rpc_batch_decoder.decode(content)
+    except msgspec.ValidationError:
+        return _decode_rpc_namespace(content)
 
 # Multiple URLs for redundancy - if one fails, try the next
 RPC_URLS = [
@@ -28,184 +80,723 @@ INDEXER_URLS = [
 
 MASP_EPOCH_MULTIPLIER = 4
 
-def try_multiple_urls(urls: List[str], endpoint: str, **kwargs) -> Optional[requests.Response]:
+# Rows are written as (height, timestamp, masp_epoch) + (token_address, last_inflation, last_locked)
+CSV_FIELDNAMES = ['height', 'timestamp', 'masp_epoch', 'token_address', 'last_inflation', 'last_locked']
+
+# Results of the start-up queries are cached so that repeated local runs can
+# skip them; the block height goes stale much faster. The cache directory is
+# gitignored and kept out of csv/, so the scheduled workflow (which starts
+# from a fresh checkout) always fetches both and never commits them. Ages are
+# measured from a timestamp stored in the file rather than its mtime.
+CACHE_DIR = ".cache"
+TOKEN_CACHE_FILE = os.path.join(CACHE_DIR, "tokens.json")
+TOKEN_CACHE_TTL = 24 * 60 * 60  # seconds
+START_HEIGHT_CACHE_FILE = os.path.join(CACHE_DIR, "start_height.json")
+START_HEIGHT_CACHE_TTL = 60  # seconds
+
+# Fallback token list (NAM only) if neither the indexers nor the cache can provide one
+FALLBACK_TOKENS = ["tnam1q9gr66cvu4hrzm0sd5kmlnjje82gs3xlfg3v6nu7"]
+
+def create_session() -> httpx.Client:
+    """
+    Create the HTTP client shared by every query, so that connections are
+    pooled and kept alive instead of paying a TCP + TLS handshake per request.
+    
+    Concurrent requests to a host are multiplexed over a single HTTP/2
+    connection (hosts that don't offer h2 via ALPN are spoken to over
+    HTTP/1.1). Only connection failures are retried here; error responses are
+    handled by falling over to the other URLs.
+    """
+    return httpx.Client(
+        follow_redirects=True,
+        transport=httpx.HTTPTransport(
+            http2=True,
+            retries=2,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=64),
+        ),
+    )
+
+SESSION = create_session()
+
+# Per-height queries are issued concurrently through this pool; its size bounds
+# the number of requests in flight against the RPC at any one time
+MAX_CONCURRENT_REQUESTS = 8
+QUERY_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS)
+
+# Maximum number of calls in one JSON-RPC batch POST; CometBFT rejects larger
+# batches by default ([rpc] max_request_batch_size = 10)
+MAX_BATCH_SIZE = 10
+
+# Number of heights queried ahead of the one currently being written
+HEIGHT_PIPELINE_DEPTH = min(MAX_CONCURRENT_REQUESTS, 4)
+
+# MASP epoch boundaries are found by bisection, so each epoch is sampled exactly
+# once however long it lasts. The search for the first boundary steps back this
+# many blocks (roughly one 24h MASP epoch at ~7s blocks); later searches use the
+# length of the last complete epoch.
+INITIAL_EPOCH_LENGTH_ESTIMATE = 12000
+
+# Requests go to the first URL in a list, and are hedged to one more URL at a
+# time whenever the latest request has taken longer than its host usually does
+# (see HostLatency). HEDGE_DELAY is used until a host has enough samples, and
+# MAX_HEDGE_DELAY caps the wait for a host that is slow across the board.
+HEDGE_DELAY = 0.2
+MAX_HEDGE_DELAY = 2.0
+REQUEST_TIMEOUT = 30  # seconds
+
+# Requests that lose a race are not cancelled and can hold a worker for up to
+# REQUEST_TIMEOUT, so the number in flight to each host, losers included, is
+# capped; a host at the cap (or whose rate limiter has no slot free) is skipped.
+# One slot per thread that can issue requests keeps a single slow host from
+# stalling every caller. The pool has a worker for every slot, so a request
+# starts as soon as it is submitted and its hedge delay never includes time
+# spent queued.
+MAX_IN_FLIGHT_PER_HOST = MAX_CONCURRENT_REQUESTS + HEIGHT_PIPELINE_DEPTH + 1
+URL_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+    max_workers=MAX_IN_FLIGHT_PER_HOST * len(RPC_URLS + INDEXER_URLS)
+)
+
+T = TypeVar("T")
+
+class TokenQuery(NamedTuple):
+    """ABCI storage paths for one token, built once per run rather than per height."""
+    address: str
+    inflation_path: str
+    locked_path: str
+    encoded_inflation_path: str
+    encoded_locked_path: str
+
+class AdaptiveRateLimiter:
+    """
+    Thread-safe limiter that spaces out requests to one host.
+    
+    Requests start at initial_rate per second. The rate is halved whenever the
+    host responds with 429 Too Many Requests, and raised by one request per
+    second after every increase_after consecutive successful responses.
+    """
+    
+    def __init__(self, initial_rate: float = 5.0, min_rate: float = 1.0, max_rate: float = 50.0, increase_after: int = 10):
+        self.rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase_after = increase_after
+        self._successes = 0
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self) -> None:
+        """Block until the next request to this host is allowed."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + 1 / self.rate
+        time.sleep(slot - now)
+    
+    def try_acquire(self) -> bool:
+        """Take the next request slot if it is free now, without waiting."""
+        with self._lock:
+            now = time.monotonic()
+            if self._next_slot > now:
+                return False
+            self._next_slot = now + 1 / self.rate
+            return True
+    
+    def record(self, status_code: int) -> None:
+        """Adjust the rate based on the status code of a response."""
+        with self._lock:
+            if status_code == 429:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self._successes = 0
+                print(f"Rate limited, reducing to {self.rate:g} requests/s")
+            elif status_code < 400:
+                self._successes += 1
+                if self._successes >= self.increase_after:
+                    self.rate = min(self.max_rate, self.rate + 1)
+                    self._successes = 0
+
+# One limiter per host, so a throttled endpoint doesn't slow down the others
+RATE_LIMITERS = {base_url: AdaptiveRateLimiter() for base_url in RPC_URLS + INDEXER_URLS}
+
+class HostLatency:
+    """
+    Thread-safe record of the response times of recent successful requests to one host.
+    
+    The hedge delay is the 95th percentile of the last window response times,
+    so a request is only hedged once it is slower than nearly all recent ones.
+    Until min_samples responses have been recorded, HEDGE_DELAY is used.
+    """
+    
+    def __init__(self, window: int = 200, min_samples: int = 10):
+        self.min_samples = min_samples
+        self._samples = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+    
+    def record(self, seconds: float) -> None:
+        """Record the response time of a successful request."""
+        with self._lock:
+            self._samples.append(seconds)
+    
+    def hedge_delay(self) -> float:
+        """How long to wait for a request to this host before hedging it."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < self.min_samples:
+            return HEDGE_DELAY
+        return min(MAX_HEDGE_DELAY, samples[int(0.95 * (len(samples) - 1))])
+
+HOST_LATENCIES = {base_url: HostLatency() for base_url in RPC_URLS + INDEXER_URLS}
+IN_FLIGHT_SLOTS = {base_url: threading.BoundedSemaphore(MAX_IN_FLIGHT_PER_HOST) for base_url in RPC_URLS + INDEXER_URLS}
+
+def race_urls(urls: List[str], fetch: Callable[[str], T], description: str) -> Optional[T]:
+    """
+    Fetch the same resource from multiple URLs, returning the first successful result.
+    
+    The URLs are started one at a time, in order. The next one is added to the
+    race whenever the latest request has gone unanswered for its host's hedge
+    delay, or as soon as a request fails. Slower requests are left to finish
+    in the background and their results discarded.
+    
+    Rate-limit and in-flight slots are taken before a request is submitted, so
+    its hedge delay only starts once it is actually sent. Hosts with no free
+    in-flight slot are passed over, and so are hosts whose rate limiter has no
+    slot free when hedging; they stay in the race for later steps. When nothing
+    is in flight, the request waits for a slot instead.
+    
+    Args:
+        urls: List of base URLs to try
+        fetch: Called with a base URL; returns the result or raises on failure
+        description: What is being fetched, for log messages
+        
+    Returns:
+        The first successful result, or None if all URLs fail
+    """
+    pending = {}
+    remaining = list(range(len(urls)))
+    
+    def timed_fetch(base_url: str) -> T:
+        started = time.monotonic()
+        result = fetch(base_url)
+        HOST_LATENCIES[base_url].record(time.monotonic() - started)
+        return result
+    
+    def launch(i: int, hedge: bool, wait_for_slot: bool = False) -> bool:
+        base_url = urls[i]
+        slots = IN_FLIGHT_SLOTS[base_url]
+        if not slots.acquire(blocking=wait_for_slot):
+            return False
+        if not hedge:
+            RATE_LIMITERS[base_url].acquire()
+        elif not RATE_LIMITERS[base_url].try_acquire():
+            slots.release()
+            return False
+        future = URL_EXECUTOR.submit(timed_fetch, base_url)
+        future.add_done_callback(lambda _: slots.release())
+        pending[future] = i
+        return True
+    
+    def launch_next() -> Optional[int]:
+        hedge = bool(pending)
+        for i in remaining:
+            if launch(i, hedge):
+                remaining.remove(i)
+                return i
+        if hedge:
+            return None
+        i = remaining.pop(0)
+        launch(i, hedge, wait_for_slot=True)
+        return i
+    
+    last_started = None
+    while remaining or pending:
+        if remaining:
+            started = launch_next()
+            if started is not None:
+                last_started = started
+        
+        done, _ = concurrent.futures.wait(
+            pending,
+            timeout=HOST_LATENCIES[urls[last_started]].hedge_delay() if remaining else None,
+            return_when=concurrent.futures.FIRST_COMPLETED,
+        )
+        for future in done:
+            i = pending.pop(future)
+            try:
+                result = future.result()
+                print(f"✓ Success with URL {i+1}: {urls[i]}")
+                for other in pending:
+                    other.cancel()
+                return result
+            except Exception as e:
+                print(f"✗ Failed with URL {i+1} ({urls[i]}): {e}")
+    
+    print(f"All URLs failed for {description}")
+    return None
+
+def check_rpc_reply(reply) -> None:
+    """
+    Raise unless a JSON-RPC reply holds a result and, for ABCI queries, a
+    successful (code 0) response.
+    
+    Nodes that have pruned a height answer ABCI queries for it with HTTP 200 and
+    a non-zero code, so these must count as failures for race_urls to keep
+    waiting for a node that has the data.
+    """
+    result = getattr(reply, "result", None)
+    if result is None:
+        raise Exception(f"No result in RPC reply: {getattr(reply, 'error', None)}")
+    response = getattr(result, "response", None)
+    if response is not None and response.code != 0:
+        raise Exception(f"ABCI query failed with code {response.code}: {getattr(response, 'info', '')}")
+
+def parse_rpc_response(response: httpx.Response):
+    """Decode an RPC response, raising unless it holds a successful JSON-RPC reply."""
+    reply = decode_rpc_reply(response.content)
+    check_rpc_reply(reply)
+    return reply
+
+def try_multiple_urls(urls: List[str], endpoint: str, parse: Optional[Callable[[httpx.Response], Any]] = None, **kwargs) -> Optional[Any]:
     """
     Try multiple URLs for a given endpoint, returning the first successful response.
     
     Args:
         urls: List of base URLs to try
         endpoint: The endpoint path to append to each URL
-        **kwargs: Additional arguments to pass to requests.get
+        parse: Called with each response inside the race; raises if it should
+            count as a failure, otherwise its result is returned instead of
+            the response
+        **kwargs: Additional arguments to pass to SESSION.get
         
     Returns:
-        The first successful response, or None if all URLs fail
+        The first successful response (or its parsed value), or None if all URLs fail
     """
-    for i, base_url in enumerate(urls):
-        try:
-            url = f"{base_url}{endpoint}"
-            print(f"Trying URL {i+1}/{len(urls)}: {url}")
-            response = requests.get(url, **kwargs)
-            response.raise_for_status()
-            print(f"✓ Success with URL {i+1}: {base_url}")
-            return response
-        except Exception as e:
-            print(f"✗ Failed with URL {i+1} ({base_url}): {e}")
-            if i == len(urls) - 1:  # Last URL
-                print(f"All URLs failed for endpoint: {endpoint}")
-                return None
-            continue
-    return None
+    kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+    
+    def fetch(base_url: str):
+        url = f"{base_url}{endpoint}"
+        print(f"Trying URL: {url}")
+        response = SESSION.get(url, **kwargs)
+        RATE_LIMITERS[base_url].record(response.status_code)
+        response.raise_for_status()
+        if parse is not None:
+            return parse(response)
+        return response
+    
+    return race_urls(urls, fetch, f"endpoint: {endpoint}")
+
+def query_rpc(endpoint: str):
+    """
+    GET an RPC endpoint, returning the first successful JSON-RPC reply.
+    
+    Each response is decoded once, inside the race, so the reply that wins is
+    handed back as is. Returns None if all RPC URLs fail.
+    """
+    return try_multiple_urls(RPC_URLS, endpoint, parse=parse_rpc_response)
+
+def load_cache(path: str, max_age: float, is_valid: Callable[[Any], bool]):
+    """
+    Load a cached JSON value.
+    
+    Args:
+        path: Path of the cache file
+        max_age: Maximum age in seconds of the cached value
+        is_valid: Checks that the cached value has the expected type
+        
+    Returns:
+        The cached value, or None if the file is missing, too old, unreadable
+        or holds an invalid value
+    """
+    try:
+        with open(path, 'rb') as f:
+            cache = orjson.loads(f.read())
+        if time.time() - cache["fetched_at"] >= max_age:
+            return None
+        value = cache["value"]
+        if not is_valid(value):
+            print(f"Ignoring invalid value in cache file {path}")
+            return None
+        return value
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Error reading cache file {path}: {e}")
+        return None
+
+def save_cache(path: str, value) -> None:
+    """Atomically write a JSON value to a cache file, along with the time it was fetched."""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"fetched_at": time.time(), "value": value}, f)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"Error writing cache file {path}: {e}")
+
+def is_token_list(value) -> bool:
+    """Check that a cached value is a list of token addresses."""
+    return isinstance(value, list) and all(isinstance(address, str) for address in value)
+
+def is_height(value) -> bool:
+    """Check that a cached value is a block height."""
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
 
 # Get the most recent block from the node
 def get_start_height() -> int:
-    """Get the current block height from the RPC node."""
-    response = try_multiple_urls(RPC_URLS, "/block")
-    if response is None:
+    """Get the current block height, from the cache if it is recent enough, otherwise from the RPC node."""
+    cached_height = load_cache(START_HEIGHT_CACHE_FILE, START_HEIGHT_CACHE_TTL, is_height)
+    if cached_height is not None:
+        print(f"Using cached block height: {cached_height}")
+        return cached_height
+    
+    reply = query_rpc("/block")
+    if reply is None:
         raise Exception("Failed to get start height from all RPC URLs")
     
     try:
-        data = response.json()
-        height = int(data["result"]["block"]["header"]["height"])
+        height = int(reply.result.block.header.height)
         print(f"Current block height: {height}")
+        save_cache(START_HEIGHT_CACHE_FILE, height)
         return height
     except Exception as e:
         print(f"Error parsing start height response: {e}")
         raise
 
 def get_token_list() -> List[str]:
-    """Get token list from the indexer API."""
+    """Get token list from the cache if it is recent enough, otherwise from the indexer API."""
+    cached_addresses = load_cache(TOKEN_CACHE_FILE, TOKEN_CACHE_TTL, is_token_list)
+    if cached_addresses is not None:
+        print(f"Using {len(cached_addresses)} cached tokens from {TOKEN_CACHE_FILE}")
+        return cached_addresses
+    
     response = try_multiple_urls(INDEXER_URLS, "/api/v1/chain/token")
     if response is None:
         print("Failed to get token list from all indexer URLs, using fallback")
-        # Fallback to NAM token if all indexers fail
-        return ["tnam1q9gr66cvu4hrzm0sd5kmlnjje82gs3xlfg3v6nu7"]
+        return get_fallback_token_list()
     
     try:
-        tokens = response.json()
+        tokens = orjson.loads(response.content)
         
         # Extract addresses from the token list
         addresses = [token["address"] for token in tokens]
         print(f"Found {len(addresses)} tokens")
+        save_cache(TOKEN_CACHE_FILE, addresses)
         return addresses
     except Exception as e:
         print(f"Error parsing token list response: {e}")
-        # Fallback to NAM token if parsing fails
-        return ["tnam1q9gr66cvu4hrzm0sd5kmlnjje82gs3xlfg3v6nu7"]
-
-# Calculating the query heights
-# If we assume 7s block time, 10000 blocks will be roughly 20 hrs
-# Therefore we should get at least one query per masp epoch (which is 24hrs)
-def do_historical_queries(start_height: int, end_height: int, end_masp_epoch: Optional[int], csv_writer, token_addresses: List[str]) -> List[int]:
-    """Query historical data at regular intervals and write to CSV."""
+        return get_fallback_token_list()
+
+def get_fallback_token_list() -> List[str]:
+    """Get the last cached token list regardless of its age, or NAM only if there is none."""
+    cached_addresses = load_cache(TOKEN_CACHE_FILE, float('inf'), is_token_list)
+    if cached_addresses:
+        print(f"Using {len(cached_addresses)} stale cached tokens from {TOKEN_CACHE_FILE}")
+        return cached_addresses
+    return FALLBACK_TOKENS
+
+def find_epoch_start(height: int, masp_epoch: int, lowest_height: int, step: int) -> Optional[int]:
+    """
+    Find the first height of a MASP epoch by bisection.
+    
+    Args:
+        height: A height within the MASP epoch
+        masp_epoch: The MASP epoch at that height
+        lowest_height: Lowest height to search
+        step: Initial distance to step back when bracketing the epoch start
+        
+    Returns:
+        The first height of the epoch, or None if the epoch extends below lowest_height
+    """
+    # Step back, doubling the step each time, until we reach an earlier epoch
+    hi = height
+    lo = max(hi - step, lowest_height)
+    while query_and_decode_masp_epoch(lo) >= masp_epoch:
+        if lo == lowest_height:
+            return None
+        hi = lo
+        step *= 2
+        lo = max(hi - step, lowest_height)
+    
+    # Bisect, keeping lo in an earlier epoch and hi in this one
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if query_and_decode_masp_epoch(mid) >= masp_epoch:
+            hi = mid
+        else:
+            lo = mid
+    return hi
+
+def find_epoch_sample_heights(start_height: int, end_height: int, end_masp_epoch: Optional[int]) -> Iterator[Tuple[int, int]]:
+    """
+    Yield one (height, masp_epoch) pair per MASP epoch, working down from start_height.
+    
+    The height is the last block of each epoch, or start_height for the epoch
+    that is still in progress. Stops after the end MASP epoch, or at the first
+    epoch that extends below end_height.
+    """
+    lowest_height = max(end_height, 1)
+    height = start_height
+    masp_epoch = query_and_decode_masp_epoch(height)
+    epoch_length = INITIAL_EPOCH_LENGTH_ESTIMATE
+    
+    while True:
+        yield height, masp_epoch
+        
+        if end_masp_epoch is not None and masp_epoch <= end_masp_epoch:
+            print(f"✓ Reached end MASP epoch {end_masp_epoch}, stopping data collection")
+            return
+        
+        epoch_start = find_epoch_start(height, masp_epoch, lowest_height, epoch_length)
+        if epoch_start is None:
+            print(f"✓ MASP epoch {masp_epoch} starts below end height {end_height}, stopping data collection")
+            return
+        
+        # Only completed epochs give a useful estimate of the next epoch's length
+        if height != start_height:
+            epoch_length = height + 1 - epoch_start
+        height = epoch_start - 1
+        masp_epoch = query_and_decode_masp_epoch(height)
+
+def do_historical_queries(start_height: int, end_height: int, end_masp_epoch: Optional[int], csv_writer, token_queries: List[TokenQuery]) -> List[int]:
+    """
+    Query historical data once per MASP epoch and write to CSV.
+    
+    The epoch boundaries are located by find_epoch_sample_heights. Up to
+    HEIGHT_PIPELINE_DEPTH token queries run while the search for the next
+    boundary continues, but results are committed strictly in descending
+    height order.
+    """
     queried_heights = []
-    interval = 10000  # Query every 10000 blocks
-    current_height = start_height
     
-    # Track seen MASP epochs to avoid duplicates
-    seen_masp_epochs = set()
+    # (height, future) pairs in the order they must be committed
+    pending = collections.deque()
     
-    while current_height >= end_height:
+    def write_next_result():
+        current_height, future = pending.popleft()
         try:
-            print(f"Querying height: {current_height}")
-            result = query_at_height(current_height, token_addresses)
+            result = future.result()
             
-            if result and result[2] not in seen_masp_epochs:  # result[2] is masp_epoch
-                # Write base row
-                base_row = {
-                    'height': result[0],
-                    'timestamp': result[1],
-                    'masp_epoch': result[2]
-                }
-                
-                # Add token-specific data
-                for token_addr, inflation, locked in result[3]:
-                    row = base_row.copy()
-                    row['token_address'] = token_addr
-                    row['last_inflation'] = inflation
-                    row['last_locked'] = locked
-                    csv_writer.writerow(row)
+            if result:
+                # One row per token, in CSV_FIELDNAMES order
+                base_row = result[:3]
+                csv_writer.writerows(base_row + token_row for token_row in result[3])
                 
-                seen_masp_epochs.add(result[2])
                 queried_heights.append(current_height)
                 print(f"✓ Data written for height {current_height}, MASP epoch {result[2]}")
-                
-                # Check if we've reached the end MASP epoch
-                if end_masp_epoch is not None and result[2] <= end_masp_epoch:
-                    print(f"✓ Reached end MASP epoch {end_masp_epoch}, stopping data collection")
-                    break
             else:
-                print(f"⚠ Skipped height {current_height} (duplicate MASP epoch or no data)")
+                print(f"⚠ Skipped height {current_height} (no data)")
                 
         except Exception as e:
             print(f"✗ Error querying height {current_height}: {e}")
+    
+    with concurrent.futures.ThreadPoolExecutor(max_workers=HEIGHT_PIPELINE_DEPTH) as height_executor:
+        try:
+            for height, masp_epoch in find_epoch_sample_heights(start_height, end_height, end_masp_epoch):
+                print(f"Querying height: {height} (MASP epoch {masp_epoch})")
+                pending.append((height, height_executor.submit(query_at_height, height, token_queries)))
+                if len(pending) >= HEIGHT_PIPELINE_DEPTH:
+                    write_next_result()
+        except Exception as e:
+            print(f"✗ Error locating MASP epoch boundaries: {e}")
         
-        # Add delay between queries to respect rate limits
-        time.sleep(1)  # 1 second delay between heights
-        
-        current_height -= interval
+        while pending:
+            write_next_result()
     
     return queried_heights
 
-def query_at_height(height: int, token_addresses: List[str]) -> Optional[Tuple[int, str, int, List[Tuple[str, int, int]]]]:
-    """Query all data for a specific height."""
+def query_at_height(height: int, token_queries: List[TokenQuery]) -> Optional[Tuple[int, str, int, List[Tuple[str, int, int]]]]:
+    """
+    Query all data for a specific height.
+
+    The MASP epoch normally comes from the lookups made while locating the
+    epoch boundaries. The remaining sub-queries are sent to the RPC as a single
+    JSON-RPC batch; if no RPC answers every call in it successfully, they are
+    issued as individual concurrent queries instead.
+    """
     try:
-        timestamp = query_block_timestamp(height)
         masp_epoch = query_and_decode_masp_epoch(height)
-        token_data = query_all_tokens_data(height, token_addresses)
+        
+        replies = query_rpc_batch(build_height_calls(height, token_queries))
+        if replies is not None:
+            timestamp = parse_block_timestamp(replies[0], height)
+            token_data = [
+                (
+                    token.address,
+                    parse_last_inflation(replies[1 + 2 * i], height, token.address),
+                    parse_last_locked(replies[2 + 2 * i], height, token.address),
+                )
+                for i, token in enumerate(token_queries)
+            ]
+        else:
+            print(f"Batch query failed for height {height}, falling back to individual queries")
+            timestamp_future = QUERY_EXECUTOR.submit(query_block_timestamp, height)
+            token_data = query_all_tokens_data(height, token_queries)
+            timestamp = timestamp_future.result()
         
         return (height, timestamp, masp_epoch, token_data)
     except Exception as e:
         print(f"Error querying height {height}: {e}")
         return None
 
+def build_height_calls(height: int, token_queries: List[TokenQuery]) -> List[Tuple[str, dict]]:
+    """
+    Build the JSON-RPC calls needed for one height.
+
+    The calls are ordered block header, then last inflation and last locked
+    for each token in turn; query_at_height relies on this order.
+    """
+    height_str = str(height)
+    calls = [("header", {"height": height_str})]
+    for token in token_queries:
+        calls.append(("abci_query", {"path": token.inflation_path, "data": "", "height": height_str, "prove": False}))
+        calls.append(("abci_query", {"path": token.locked_path, "data": "", "height": height_str, "prove": False}))
+    return calls
+
+def query_rpc_batch(calls: List[Tuple[str, dict]]) -> Optional[list]:
+    """
+    Send several JSON-RPC calls to the RPC as batch POSTs.
+    
+    The calls are split into batches of at most MAX_BATCH_SIZE, which are sent
+    concurrently.
+    
+    Args:
+        calls: List of (method, params) pairs
+        
+    Returns:
+        One successful reply per call, in the same order as calls, or None if
+        no RPC URL answered every call in some batch
+    """
+    futures = [
+        QUERY_EXECUTOR.submit(post_rpc_batch, calls[i:i + MAX_BATCH_SIZE])
+        for i in range(0, len(calls), MAX_BATCH_SIZE)
+    ]
+    replies = []
+    for future in futures:
+        batch_replies = future.result()
+        if batch_replies is None:
+            for other in futures:
+                other.cancel()
+            return None
+        replies.extend(batch_replies)
+    return replies
+
+def post_rpc_batch(calls: List[Tuple[str, dict]]) -> Optional[list]:
+    """
+    Send several JSON-RPC calls to the RPC in a single batch POST.
+    
+    Args:
+        calls: List of (method, params) pairs, at most MAX_BATCH_SIZE of them
+        
+    Returns:
+        One successful reply per call, in the same order as calls, or None if
+        no RPC URL answered every call in the batch (see check_rpc_reply)
+    """
+    body = [
+        {"jsonrpc": "2.0", "id": i, "method": method, "params": params}
+        for i, (method, params) in enumerate(calls)
+    ]
+    
+    def fetch(base_url: str) -> list:
+        response = SESSION.post(base_url, json=body, timeout=REQUEST_TIMEOUT)
+        RATE_LIMITERS[base_url].record(response.status_code)
+        response.raise_for_status()
+        replies = {reply.id: reply for reply in decode_rpc_batch(response.content)}
+        ordered_replies = [replies.get(call_id) for call_id in range(len(calls))]
+        for reply in ordered_replies:
+            check_rpc_reply(reply)
+        return ordered_replies
+    
+    return race_urls(RPC_URLS, fetch, f"batch of {len(calls)} calls")
+
+def build_token_queries(token_addresses: List[str]) -> List[TokenQuery]:
+    """Precompute the raw and URL-encoded ABCI paths for each token."""
+    token_queries = []
+    for token_addr in token_addresses:
+        inflation_path = last_inflation_path(token_addr)
+        locked_path = last_locked_path(token_addr)
+        token_queries.append(TokenQuery(
+            address=token_addr,
+            inflation_path=inflation_path,
+            locked_path=locked_path,
+            encoded_inflation_path=quote(f'"{inflation_path}"'),
+            encoded_locked_path=quote(f'"{locked_path}"'),
+        ))
+    return token_queries
+
+def masp_epoch_path(height: int) -> str:
+    """ABCI query path for the epoch at a given height."""
+    return f"/shell/epoch_at_height/{height}"
+
+def last_inflation_path(asset_address: str) -> str:
+    """ABCI storage path for the last inflation of an asset."""
+    return f"/shell/value/#tnam1pyqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqej6juv/#{asset_address}/parameters/last_inflation"
+
+def last_locked_path(asset_address: str) -> str:
+    """ABCI storage path for the last locked amount of an asset."""
+    return f"/shell/value/#tnam1pyqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqej6juv/#{asset_address}/parameters/last_locked_amount"
+
 def query_block_timestamp(height: int) -> str:
     """Get the timestamp from block header."""
-    response = try_multiple_urls(RPC_URLS, f"/block?height={height}")
-    if response is None:
+    # /header returns just the header, a fraction of the size of the full block
+    reply = query_rpc(f"/header?height={height}")
+    if reply is None:
+        # Nodes older than CometBFT 0.37 don't serve /header
+        reply = query_rpc(f"/block?height={height}")
+    if reply is None:
         raise Exception(f"Failed to get timestamp for height {height} from all RPC URLs")
     
+    return parse_block_timestamp(reply, height)
+
+def parse_block_timestamp(reply, height: int) -> str:
+    """Extract the block timestamp from a header or block response."""
     try:
-        data = response.json()
-        timestamp = data["result"]["block"]["header"]["time"]
+        result = reply.result
+        header = getattr(result, "header", None) or result.block.header
+        timestamp = header.time
         return timestamp
     except Exception as e:
         print(f"Error parsing timestamp response for height {height}: {e}")
         raise
 
+@functools.lru_cache(maxsize=None)
 def query_and_decode_masp_epoch(height: int) -> int:
-    """Get and decode the MASP epoch value."""
-    path = f"/shell/epoch_at_height/{height}"
-    encoded_path = quote(f'"{path}"')
-    response = try_multiple_urls(RPC_URLS, f"/abci_query?path={encoded_path}")
-    if response is None:
-        print(f"Failed to get MASP epoch for height {height} from all RPC URLs")
-        return 0
+    """
+    Get and decode the MASP epoch value.
     
-    try:
-        data = response.json()
-        
-        if data["result"]["response"]["code"] == 0:
-            value = data["result"]["response"]["value"]
-            epoch = decode_abci_option_epoch(value)
-            print(f"epoch: {epoch}")
-            # MASP epoch is the epoch divided by MASP_EPOCH_MULTIPLIER, discarding remainder
-            return epoch // MASP_EPOCH_MULTIPLIER
-        else:
-            print(f"No MASP epoch data at height {height}")
-            return 0
-    except Exception as e:
-        print(f"Error parsing MASP epoch response for height {height}: {e}")
-        return 0
+    The epoch at a height never changes, so results are memoized for the run.
+    Raises if the epoch can't be determined, so that failures aren't cached and
+    a placeholder epoch never reaches the epoch search or the CSV.
+    """
+    encoded_path = quote(f'"{masp_epoch_path(height)}"')
+    reply = query_rpc(f"/abci_query?path={encoded_path}")
+    if reply is None:
+        raise Exception(f"Failed to get MASP epoch for height {height} from all RPC URLs")
+    
+    return parse_masp_epoch(reply, height)
+
+def parse_masp_epoch(reply, height: int) -> int:
+    """Decode the MASP epoch from an epoch_at_height ABCI response, raising if there is none."""
+    epoch = decode_abci_option_epoch(reply.result.response.value)
+    if epoch is None:
+        raise Exception(f"No MASP epoch at height {height}")
+    print(f"epoch: {epoch}")
+    # MASP epoch is the epoch divided by MASP_EPOCH_MULTIPLIER, discarding remainder
+    return epoch // MASP_EPOCH_MULTIPLIER
 
-def query_all_tokens_data(height: int, token_addresses: List[str]) -> List[Tuple[str, int, int]]:
+def query_all_tokens_data(height: int, token_queries: List[TokenQuery]) -> List[Tuple[str, int, int]]:
     """Query last inflation and locked data for all tokens."""
+    futures = [
+        (
+            token.address,
+            QUERY_EXECUTOR.submit(query_and_decode_last_inflation, height, token),
+            QUERY_EXECUTOR.submit(query_and_decode_last_locked, height, token),
+        )
+        for token in token_queries
+    ]
     token_data = []
     
-    for token_addr in token_addresses:
+    for token_addr, inflation_future, locked_future in futures:
         try:
-            last_inflation = query_and_decode_last_inflation(height, token_addr)
-            last_locked = query_and_decode_last_locked(height, token_addr)
-            token_data.append((token_addr, last_inflation, last_locked))
+            token_data.append((token_addr, inflation_future.result(), locked_future.result()))
         except Exception as e:
             print(f"Error querying token {token_addr} at height {height}: {e}")
             # Add default values for failed queries
@@ -213,46 +804,48 @@ def query_all_tokens_data(height: int, token_addresses: List[str]) -> List[Tuple
     
     return token_data
 
-def query_and_decode_last_inflation(height: int, asset_address: str) -> int:
+def query_and_decode_last_inflation(height: int, token: TokenQuery) -> int:
     """Get and decode the last inflation value for a specific asset."""
-    path = f"/shell/value/#tnam1pyqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqej6juv/#{asset_address}/parameters/last_inflation"
-    encoded_path = quote(f'"{path}"')
-    response = try_multiple_urls(RPC_URLS, f"/abci_query?path={encoded_path}&height={height}")
-    if response is None:
+    asset_address = token.address
+    reply = query_rpc(f"/abci_query?path={token.encoded_inflation_path}&height={height}")
+    if reply is None:
         print(f"Failed to get last inflation for {asset_address} at height {height} from all RPC URLs")
         return 0
     
+    return parse_last_inflation(reply, height, asset_address)
+
+def parse_last_inflation(reply, height: int, asset_address: str) -> int:
+    """
+    Decode the last inflation value from an ABCI response.
+    
+    Replies with a non-zero code never get here; check_rpc_reply rejects them
+    while the RPC URLs are raced.
+    """
     try:
-        data = response.json()
-        
-        if data["result"]["response"]["code"] == 0:
-            value = data["result"]["response"]["value"]
-            return decode_abci_int(value)
-        else:
-            print(f"No last inflation data for {asset_address} at height {height}")
-            return 0
+        return decode_abci_int(reply.result.response.value)
     except Exception as e:
         print(f"Error parsing last inflation response for {asset_address} at height {height}: {e}")
         return 0
 
-def query_and_decode_last_locked(height: int, asset_address: str) -> int:
+def query_and_decode_last_locked(height: int, token: TokenQuery) -> int:
     """Get and decode the last locked amount value for a specific asset."""
-    path = f"/shell/value/#tnam1pyqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqej6juv/#{asset_address}/parameters/last_locked_amount"
-    encoded_path = quote(f'"{path}"')
-    response = try_multiple_urls(RPC_URLS, f"/abci_query?path={encoded_path}&height={height}")
-    if response is None:
+    asset_address = token.address
+    reply = query_rpc(f"/abci_query?path={token.encoded_locked_path}&height={height}")
+    if reply is None:
         print(f"Failed to get last locked for {asset_address} at height {height} from all RPC URLs")
         return 0
     
+    return parse_last_locked(reply, height, asset_address)
+
+def parse_last_locked(reply, height: int, asset_address: str) -> int:
+    """
+    Decode the last locked amount value from an ABCI response.
+    
+    Replies with a non-zero code never get here; check_rpc_reply rejects them
+    while the RPC URLs are raced.
+    """
     try:
-        data = response.json()
-        
-        if data["result"]["response"]["code"] == 0:
-            value = data["result"]["response"]["value"]
-            return decode_abci_int(value)
-        else:
-            print(f"No last locked data for {asset_address} at height {height}")
-            return 0
+        return decode_abci_int(reply.result.response.value)
     except Exception as e:
         print(f"Error parsing last locked response for {asset_address} at height {height}: {e}")
         return 0
@@ -263,15 +856,8 @@ def decode_abci_int(base64_str: str) -> int:
         if not base64_str:
             return 0
         
-        # Decode base64
-        decoded_bytes = base64.b64decode(base64_str)
-        
-        # Convert bytes to integer (little-endian)
-        result = 0
-        for i, byte in enumerate(decoded_bytes):
-            result += byte * (256 ** i)
-        
-        return result
+        # Decode base64 and convert bytes to integer (little-endian)
+        return int.from_bytes(base64.b64decode(base64_str), "little")
     except Exception as e:
         print(f"Error decoding base64 string '{base64_str}': {e}")
         return 0
@@ -315,7 +901,7 @@ def decode_abci_option_epoch(base64_str: str) -> int:
             
             # Extract the u64 epoch value (little-endian)
             epoch_bytes = decoded_bytes[1:9]
-            epoch_value = struct.unpack('<Q', epoch_bytes)[0]  # '<Q' = little-endian u64
+            epoch_value = int.from_bytes(epoch_bytes, "little")
             
             return epoch_value
         else:
@@ -341,6 +927,7 @@ def main():
     # Get token list
     token_addresses = get_token_list()
     print(f"Tokens to query: {token_addresses}")
+    token_queries = build_token_queries(token_addresses)
     
     # Prepare CSV writer
     date_str = datetime.now().strftime("%Y-%m-%d")
@@ -351,9 +938,8 @@ def main():
     filename = f"csv/{date_str}.csv"
     
     with open(filename, 'w', newline='') as csvfile:
-        fieldnames = ['height', 'timestamp', 'masp_epoch', 'token_address', 'last_inflation', 'last_locked']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
+        writer = csv.writer(csvfile)
+        writer.writerow(CSV_FIELDNAMES)
         
         try:
             # Get start height
@@ -370,7 +956,7 @@ def main():
             print(f"End MASP epoch: {end_masp_epoch if end_masp_epoch is not None else 'None (no limit)'}")
             
             # Do historical queries
-            queried_heights = do_historical_queries(start_height, end_height, end_masp_epoch, writer, token_addresses)
+            queried_heights = do_historical_queries(start_height, end_height, end_masp_epoch, writer, token_queries)
             
             print(f"\nData collection complete!")
             print(f"Results saved to: {filename}")
@@ -378,6 +964,10 @@ def main():
             
         except Exception as e:
             print(f"Error in main execution: {e}")
+        finally:
+            QUERY_EXECUTOR.shutdown(cancel_futures=True)
+            URL_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+            SESSION.close()
     
     print("CSV file closed.")
 
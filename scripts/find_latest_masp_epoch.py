@@ -9,9 +9,38 @@ import csv
 import glob
 from typing import Optional
 
+def scan_csv_max_epoch(csv_file: str) -> Optional[int]:
+    """
+    Read a CSV file and return its highest MASP epoch.
+    
+    Args:
+        csv_file: Path of the CSV file
+        
+    Returns:
+        The highest MASP epoch in the file, or None if it has no valid rows
+    """
+    with open(csv_file, 'r', newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader, None)
+        if header is None:
+            return None
+        
+        # Locate the column once, then let max() scan the rows,
+        # skipping any with an invalid or missing masp_epoch
+        epoch_index = header.index('masp_epoch')
+        return max(
+            (int(row[epoch_index]) for row in reader
+             if len(row) > epoch_index and row[epoch_index].isdigit()),
+            default=None
+        )
+
 def find_latest_masp_epoch(csv_dir: str = "csv") -> Optional[int]:
     """
-    Find the highest MASP epoch from all CSV files in the specified directory.
+    Find the highest MASP epoch from the CSV files in the specified directory.
+    
+    Files are named by date and MASP epochs only increase over time, so the
+    files are checked newest first and the search stops at the first one that
+    contains any data; older files are only read if the newer ones are empty.
     
     Args:
         csv_dir: Directory containing CSV files (default: "csv")
@@ -24,8 +53,8 @@ def find_latest_masp_epoch(csv_dir: str = "csv") -> Optional[int]:
         print(f"Directory '{csv_dir}' does not exist")
         return None
     
-    # Find all CSV files
-    csv_files = glob.glob(os.path.join(csv_dir, "*.csv"))
+    # Find all CSV files, newest first
+    csv_files = sorted(glob.glob(os.path.join(csv_dir, "*.csv")), reverse=True)
     
     if not csv_files:
         print(f"No CSV files found in '{csv_dir}'")
@@ -37,17 +66,11 @@ def find_latest_masp_epoch(csv_dir: str = "csv") -> Optional[int]:
     
     for csv_file in csv_files:
         try:
-            with open(csv_file, 'r', newline='') as file:
-                reader = csv.DictReader(file)
-                
-                for row in reader:
-                    try:
-                        masp_epoch = int(row['masp_epoch'])
-                        if highest_masp_epoch is None or masp_epoch > highest_masp_epoch:
-                            highest_masp_epoch = masp_epoch
-                    except (ValueError, KeyError) as e:
-                        # Skip rows with invalid or missing masp_epoch
-                        continue
+            file_max = scan_csv_max_epoch(csv_file)
+            
+            if file_max is not None:
+                highest_masp_epoch = file_max
+                break
                         
         except Exception as e:
             print(f"Error reading {csv_file}: {e}")